@@ -1,61 +1,430 @@
 # backend/agent.py - Updated with better error handling
 import os
 import re
-import json
-import pytz
-from datetime import datetime, timedelta, time
-from typing import Dict, List, Any
-from langchain.agents import Tool
-from langchain.agents import initialize_agent, AgentType
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage
+import logging
+import orjson
+import asyncio
+import time as time_module
+import hashlib
+import itertools
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, time
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Any, Optional, AsyncIterator
+from pydantic import BaseModel, Field
+# langchain.agents, langchain.memory and langchain_google_genai take seconds to
+# import, so they are loaded where first used instead of at module import
+from langchain_core.tools import StructuredTool
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import HumanMessage, SystemMessage
+from semantic_cache import SemanticCache
 
+log = logging.getLogger(__name__)
+
+_IST = ZoneInfo("Asia/Kolkata")
+_DAY_START = time(0, 0, 0)
+_DAY_END = time(23, 59, 0)
+
+# Suggestion cache settings
+SUGGEST_CACHE_TTL = 3600  # seconds
+SUGGEST_SIMILARITY_THRESHOLD = 0.92
+SUGGEST_CACHE_SIZE = 1024  # exact and semantic entries each
+# Semantic cache of whole agent replies, shared across sessions
+CHAT_CACHE_THRESHOLD = 0.90
+CHAT_CACHE_TTL = 300  # seconds
+CHAT_CACHE_MAX_ENTRIES = 10000
+# Exact (message, recent history) replays, checked before embedding anything
+CHAT_EXACT_CACHE_SIZE = 1024
+CHAT_EXACT_CACHE_TAIL = 4  # messages of history in the key
+# Conversation turns kept in the agent prompt
+MEMORY_WINDOW_TURNS = 10
+# Least recently used sessions beyond this are dropped
+MAX_SESSIONS = 10000
+
+# Intent patterns, compiled once and shared by every message
+_CONFIRM_RE = re.compile(r'^(y|yes|n|no|cancel|confirm|yes to all)$')
+_GREETING_RE = re.compile(r'^(hi|hello|hey)$')
+_BOOK_RE = re.compile(r'book', re.I)
+_ISO_DATE_RE = re.compile(r'\b\d{4}-\d{2}-\d{2}\b')
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.S)
+_AVAILABILITY_RE = re.compile(r'\b(available|availability|free)\b', re.I)
+_PLANNING_RE = re.compile(r'\b(book|suggest|best|plan)\w*', re.I)
+_DATE_TOKEN_RE = re.compile(r'\b(today|tomorrow|\d{4}-\d{2}-\d{2})\b', re.I)
+_CHECK_RE = re.compile(r'^\s*(check|show|list)\b', re.I)
+# Only a bare "what's the date/time (now)?"; "the time slot for ..." goes to the agent
+_CURRENT_DATE_RE = re.compile(r'^\s*(current|what.?s the|what is the)\s+(current\s+)?(date|time)(\s+(now|today))?\s*\??\s*$', re.I)
+# Dates, numbers and day names: prompts differing only in these must not share a reply
+_CACHE_TOKEN_RE = re.compile(
+    r'\d+|\b(jan(uary)?|feb(ruary)?|mar(ch)?|apr(il)?|may|june?|july?|aug(ust)?|'
+    r'sep(t(ember)?)?|oct(ober)?|nov(ember)?|dec(ember)?|mon(day)?|tue(s(day)?)?|'
+    r'wed(nesday)?|thu(rs(day)?)?|fri(day)?|sat(urday)?|sun(day)?|'
+    r'today|tonight|tomorrow|yesterday|next|last|this)\b', re.I)
+# Replies to these depend on booking state, so they never go through the chat cache
+_NO_CACHE_RE = re.compile(r'\b(book\w*|confirm\w*|cancel\w*|schedule\w*|yes|no)\b', re.I)
+
+GREETING_RESPONSE = "Hello! I'm your AI appointment booking assistant. I can help you check availability and book appointments on your Google Calendar. What would you like to do?"
+HELP_RESPONSE = "I can help you with:\n• Check availability for specific dates\n• Book appointments\n• Suggest time slots\n\nTry saying 'Check availability for today' or 'Book a meeting tomorrow at 2 PM'"
+
+SYSTEM_MESSAGE = """You are a helpful AI assistant that helps users book appointments on their Google Calendar.
+
+Your capabilities:
+1. Check calendar availability for specific dates
+2. Suggest available time slots
+3. Book appointments with user confirmation
+4. Handle natural language requests conversationally
+
+Guidelines:
+- Always be polite and conversational
+- Confirm details before booking
+- Ask for clarification when needed
+- Provide clear available time slots
+- Handle date parsing naturally (today, tomorrow, specific dates)
+- For booking, always confirm: title, date, time, and duration
+- Use the tools available to you: check_availability, book_appointment, get_current_date
+
+When booking appointments:
+- Always confirm all details with the user first
+- Ask for a title/purpose for the appointment
+- Clarify the duration if not specified (default to 1 hour)
+- Show available time slots before booking
+- if only time or only date is given before trying any tool ask the other thing
+"""
+
+# Fixed instructions for suggest_suitable_time; kept identical across calls so
+# Gemini can reuse the cached prompt prefix, with only the short request varying
+_SUGGEST_SYSTEM = SystemMessage(content=(
+    "You're an expert scheduling assistant.\n"
+    "You are given a date, the busy intervals on that date (24‑hour HH:MM) and a task request.\n"
+    "Suggest a suitable time for the task on that date.\n"
+    "Make sure the suggested time does NOT overlap with the busy intervals."
+))
+
+# Tags the agent's own model calls so streaming skips tool-internal LLM calls
+AGENT_LLM_TAG = "appointment_agent"
+
+
+class CheckAvailabilityArgs(BaseModel):
+    date_input: str = Field(description="Date in YYYY-MM-DD format, 'today', or 'tomorrow'")
+
+
+class SuggestTimeArgs(BaseModel):
+    date: str = Field(description="Date in YYYY-MM-DD format, 'today', or 'tomorrow'")
+    query: str = Field(description="Detailed description of the task or plan to find a time for")
+
+
+class BookAppointmentArgs(BaseModel):
+    title: str = Field(default="Appointment", description="A short title or purpose for the appointment")
+    start_time: datetime = Field(description="ISO format start datetime, e.g. '2025-07-04T14:00:00'")
+    end_time: datetime = Field(description="ISO format end datetime, e.g. '2025-07-04T15:00:00'")
+    description: str = Field(default="", description="Optional details about the appointment")
+
+
+class BookAppointmentsBatchArgs(BaseModel):
+    appointments: List[BookAppointmentArgs] = Field(description="The appointments to book")
+
+
+class ConfirmBookingArgs(BaseModel):
+    answer: str = Field(description="'yes' to confirm, 'no' to cancel, or 'yes to all' to confirm every pending booking")
+
+
+class CurrentDateArgs(BaseModel):
+    query: str = Field(default="", description="Unused")
+
+# Built once per process and shared by every session. The static system prompt
+# always comes first, so each request to Gemini starts with the same prefix
+# and can reuse the model's implicit prompt cache.
+AGENT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_MESSAGE),
+    MessagesPlaceholder("chat_history"),
+    ("human", "{input}"),
+    MessagesPlaceholder("agent_scratchpad"),
+])
+
+
+def _sync_fallback(coro_fn):
+    """Wrap an async tool so the sync agent path can still call it"""
+    def wrapper(*args, **kwargs):
+        return asyncio.run(coro_fn(*args, **kwargs))
+    return wrapper
+
+
+@lru_cache(maxsize=256)
+def _parse_iso_date(value: str) -> date:
+    """Parse a YYYY-MM-DD string, memoized for repeated tool inputs"""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_user_date(value: str, today: Optional[date] = None) -> date:
+    """Resolve 'today', 'tomorrow' or a YYYY-MM-DD string to a date"""
+    lower = value.lower()
+    if 'today' in lower or 'tomorrow' in lower:
+        if today is None:
+            today = datetime.now().date()
+        return today if 'today' in lower else today + timedelta(days=1)
+    return _parse_iso_date(value)
+
+
+@lru_cache(maxsize=64)
+def _day_bounds_ist(d: date) -> tuple:
+    """ISO start/end-of-day strings in IST for a date"""
+    return (datetime.combine(d, _DAY_START, _IST).isoformat(),
+            datetime.combine(d, _DAY_END, _IST).isoformat())
+
+
+def _to_local(dt: datetime) -> datetime:
+    """Convert an aware datetime to naive IST; naive values are assumed to be IST already"""
+    if dt.tzinfo is not None:
+        return dt.astimezone(_IST).replace(tzinfo=None)
+    return dt
+
+
+def _ttl_get(cache: OrderedDict, key: str) -> Optional[str]:
+    """Return the unexpired value of a (value, expiry) entry, dropping it once expired"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry[1] <= time_module.time():
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return entry[0]
+
+
+def _ttl_put(cache: OrderedDict, key: str, value: str, ttl: float, max_size: int) -> None:
+    """Store value for ttl seconds, dropping the least recently used entry when full"""
+    cache[key] = (value, time_module.time() + ttl)
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+class ChatSession:
+    """Conversation state for one user session"""
+    def __init__(self, memory, tools: List[StructuredTool], agent):
+        self.pending_bookings = []
+        self.memory = memory
+        self.tools = {tool.name: tool for tool in tools}
+        self.agent = agent
+        # Serializes turns so pending_bookings and memory are never mutated concurrently
+        self.lock = asyncio.Lock()
 
 
 class AppointmentBookingAgent:
+    """Shares the Gemini clients and caches across all user sessions"""
     def __init__(self, calendar_service, gemini_api_key: str):
-        self.pending_bookings = []
+        from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+
         self.calendar_service = calendar_service
         try:
             self.llm = ChatGoogleGenerativeAI(
                 model="gemini-2.5-pro",
                 google_api_key=gemini_api_key,
-                temperature=0.7
+                temperature=0.7,
+                streaming=True
             )
-            print("✅ Gemini LLM initialized successfully")
+            # Deterministic model for time suggestions so cached answers stay valid
+            self.suggest_llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-pro",
+                google_api_key=gemini_api_key,
+                temperature=0
+            )
+            log.info("✅ Gemini LLM initialized successfully")
         except Exception as e:
-            print(f"❌ Error initializing Gemini: {e}")
+            log.error("❌ Error initializing Gemini: %s", e)
             raise
-            
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
+
+        # Suggestion cache: exact key -> (response, expiry), plus similar queries
+        # matched within the same (date, busy) bucket
+        self._suggest_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._suggest_semantic = SemanticCache(
+            threshold=SUGGEST_SIMILARITY_THRESHOLD,
+            max_entries=SUGGEST_CACHE_SIZE,
+            ttl=SUGGEST_CACHE_TTL
+        )
+        # Agent replies for near-duplicate prompts; cleared on booking and at midnight
+        self._response_cache = SemanticCache(
+            threshold=CHAT_CACHE_THRESHOLD,
+            max_entries=CHAT_CACHE_MAX_ENTRIES,
+            ttl=CHAT_CACHE_TTL
         )
-        self.tools = self._create_tools()
-        self.agent = self._create_agent()
+        # Exact replays: key -> (response, expiry), with the same lifetime as above
+        self._exact_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._response_cache_day = date.today()
+        self._response_cache_path = os.getenv("SEMANTIC_CACHE_PATH")
+        if self._response_cache_path:
+            self._response_cache.load(self._response_cache_path)
+        try:
+            self.embeddings = GoogleGenerativeAIEmbeddings(
+                model="models/text-embedding-004",
+                google_api_key=gemini_api_key
+            )
+        except Exception as e:
+            log.warning("⚠️ Embeddings unavailable, semantic suggestion cache disabled: %s", e)
+            self.embeddings = None
+
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # Tags the pending bookings queued by one book_appointments_batch call
+        self._batch_ids = itertools.count(1)
+
+    def _get_session(self, session_id: str) -> ChatSession:
+        """Return the session for session_id, creating it on first use"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        else:
+            from langchain.memory import ConversationBufferWindowMemory
+
+            # Bounded window keeps the prompt a constant size; booking state lives
+            # in pending_bookings, so older turns are not needed
+            memory = ConversationBufferWindowMemory(
+                memory_key="chat_history",
+                input_key="input",
+                output_key="output",
+                return_messages=True,
+                k=MEMORY_WINDOW_TURNS
+            )
+            session = ChatSession(memory, [], None)
+            tools = self._create_tools(session)
+            session.tools = {tool.name: tool for tool in tools}
+            session.agent = self._create_agent(tools, memory)
+            self._sessions[session_id] = session
+            if len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        return session
+
+    def drop_session(self, session_id: str) -> None:
+        """Forget a session's memory and pending bookings"""
+        self._sessions.pop(session_id, None)
+
+    def _get_cached_suggestion(self, key: str, bucket: str, embedding: Optional[List[float]]) -> Optional[str]:
+        """Look up a suggestion by exact key, then by query similarity within the bucket"""
+        cached = _ttl_get(self._suggest_cache, key)
+        if cached is None and embedding is not None:
+            cached = self._suggest_semantic.lookup(embedding, bucket)
+        return cached
+
+    async def _get_availability(self, start_iso: str, end_iso: str) -> List[Dict]:
+        """Fetch busy intervals off the event loop; CalendarService caches them briefly"""
+        return await asyncio.to_thread(self.calendar_service.get_availability, start_iso, end_iso)
+
+    async def _embed_query(self, query: str) -> Optional[List[float]]:
+        """Embed a query for the semantic suggestion cache, None when unavailable"""
+        if self.embeddings is None:
+            return None
+        try:
+            return await self.embeddings.aembed_query(query)
+        except Exception as e:
+            log.warning("⚠️ Embedding failed, skipping semantic cache: %s", e)
+            return None
+
+    def _invalidate_calendar_caches(self) -> None:
+        """Forget cached replies after the calendar changed"""
+        self._exact_cache.clear()
+        self._response_cache.clear()
+
+    def _expire_reply_caches(self) -> None:
+        """'today'/'tomorrow' answers are only valid for the day they were made"""
+        today = date.today()
+        if today != self._response_cache_day:
+            self._exact_cache.clear()
+            self._response_cache.clear()
+            self._response_cache_day = today
+
+    @staticmethod
+    def _history_tail(session: ChatSession) -> str:
+        """The last few turns of the session, as cache-key text"""
+        tail = session.memory.chat_memory.messages[-CHAT_EXACT_CACHE_TAIL:]
+        return "\n".join(f"{m.type}:{m.content}" for m in tail)
+
+    @classmethod
+    def _exact_key(cls, session: ChatSession, message: str) -> str:
+        """Hash the message together with the last few turns of the session"""
+        return hashlib.sha256((message + "||" + cls._history_tail(session)).encode()).hexdigest()
+
+    @classmethod
+    def _semantic_bucket(cls, session: ChatSession, message: str) -> str:
+        """Similar prompts only share a reply with the same recent history and date/number tokens"""
+        history = hashlib.sha256(cls._history_tail(session).encode()).hexdigest()
+        tokens = " ".join(m.group(0).lower() for m in _CACHE_TOKEN_RE.finditer(message))
+        return f"{history}|{tokens}"
+
+    def _lookup_exact(self, key: str) -> Optional[str]:
+        """Return the unexpired reply stored for an identical prompt, None on a miss"""
+        self._expire_reply_caches()
+        return _ttl_get(self._exact_cache, key)
+
+    def _store_exact(self, key: str, response: str) -> None:
+        """Remember a reply for CHAT_CACHE_TTL, dropping the least recently used one when full"""
+        _ttl_put(self._exact_cache, key, response, CHAT_CACHE_TTL, CHAT_EXACT_CACHE_SIZE)
+
+    def _lookup_response(self, embedding: Optional[List[float]], bucket: str) -> Optional[str]:
+        """Return a cached agent reply for a similar prompt in bucket, None on a miss"""
+        if embedding is None:
+            return None
+        self._expire_reply_caches()
+        return self._response_cache.lookup(embedding, bucket)
+
+    async def _cached_reply(self, session: ChatSession, message: str) -> tuple:
+        """Look up an agent turn in the reply caches.
+
+        Returns (reply or None, store key); the key is None when the turn must
+        not be cached, otherwise it is passed to _store_reply after the agent ran.
+        """
+        if session.pending_bookings or _NO_CACHE_RE.search(message):
+            return None, None
+        exact_key = self._exact_key(session, message)
+        bucket = self._semantic_bucket(session, message)
+        embedding = None
+        cached = self._lookup_exact(exact_key)
+        if cached is None:
+            embedding = await self._embed_query(message.strip().lower())
+            cached = self._lookup_response(embedding, bucket)
+        if cached is not None:
+            session.memory.save_context({"input": message}, {"output": cached})
+            log.info("⚡ Cached response: %s", cached)
+        return cached, (exact_key, bucket, embedding)
+
+    def _store_reply(self, session: ChatSession, key: Optional[tuple], response: str) -> None:
+        """Remember an agent reply, unless the turn queued or made a booking"""
+        if key is None or not response or session.pending_bookings or "booked successfully" in response:
+            return
+        exact_key, bucket, embedding = key
+        self._store_exact(exact_key, response)
+        if embedding is not None:
+            self._response_cache.add(embedding, response, bucket)
+
+    def save_response_cache(self) -> None:
+        """Persist the reply cache to SEMANTIC_CACHE_PATH, if configured"""
+        if self._response_cache_path:
+            self._response_cache.save(self._response_cache_path)
+
+    def _store_suggestion(self, key: str, bucket: str, embedding: Optional[List[float]], value: str) -> None:
+        """Store a suggestion under its exact key and, when embedded, for similar queries"""
+        _ttl_put(self._suggest_cache, key, value, SUGGEST_CACHE_TTL, SUGGEST_CACHE_SIZE)
+        if embedding is not None:
+            self._suggest_semantic.add(embedding, value, bucket)
     
-    def _create_tools(self) -> List[Tool]:
-        """Create tools for the agent"""
+    def _create_tools(self, session: ChatSession) -> List[StructuredTool]:
+        """Create tools for the agent, bound to one session's pending bookings"""
         
-        def check_availability(date_input: str) -> str:
+        async def check_availability(date_input: str) -> str:
             """Check availability for a specific date"""
             try:
-                print(f"Checking availability for: {date_input}")
-                now = datetime.now()
-                if 'today' in date_input.lower():
-                    target_date = datetime.now().date()
-                elif 'tomorrow' in date_input.lower():
-                    target_date = datetime.now().date() + timedelta(days=1)
-                else:
-                    try:
-                        target_date = datetime.strptime(date_input, '%Y-%m-%d').date()
-                    except:
-                        return "Please provide a valid date in YYYY-MM-DD format, or use 'today' or 'tomorrow'."
+                log.debug("Checking availability for: %s", date_input)
+                today = datetime.now().date()
+                try:
+                    target_date = _parse_user_date(date_input, today)
+                except ValueError:
+                    return "Please provide a valid date in YYYY-MM-DD format, or use 'today' or 'tomorrow'."
                 
                 # Get available slots
-                print(f" Checking availability for {target_date}")
-                output = self.calendar_service.get_free_intervals_for_date(target_date.isoformat() + 'T00:00:00Z', skip_before=now.date().isoformat() + 'T00:00:00Z' if target_date == now.date() else None)
+                log.debug("Checking availability for %s", target_date)
+                output = await asyncio.to_thread(
+                    self.calendar_service.get_free_intervals_for_date,
+                    target_date.isoformat() + 'T00:00:00Z',
+                    skip_before=today.isoformat() + 'T00:00:00Z' if target_date == today else None
+                )
                 condition = output[0]
                 content = output[1]
                 if condition:
@@ -69,103 +438,98 @@ class AppointmentBookingAgent:
                     return f"Sorry, I couldn't check availability. Error: {str(content)}"
                 
             except Exception as e:
-                print(f" Error in check_availability: {e}")
+                log.error("❌ Error in check_availability: %s", e)
                 return f"Sorry, I couldn't check availability. Error: {str(e)}"
             
-        def suggest_suitable_time(input_str) -> str:
+        async def suggest_suitable_time(date: str, query: str) -> str:
             try:
-                data = json.loads(input_str)
-                date = data['date']
-                query = data['query']
                 """
                 Extracts task and date from the query, asks Gemini for JSON output, 
                 and checks against the calendar for a suitable time.
                 """
-                if 'today' in date.lower():
-                    target_date = datetime.now().date()
-                elif 'tomorrow' in date.lower():
-                    target_date = datetime.now().date() + timedelta(days=1)
-                else:
-                    try:
-                        target_date = datetime.strptime(date, '%Y-%m-%d').date()
-                    except:
-                        return "Please provide a valid date in YYYY-MM-DD format, or use 'today' or 'tomorrow'."
+                try:
+                    target_date = _parse_user_date(date)
+                except ValueError:
+                    return "Please provide a valid date in YYYY-MM-DD format, or use 'today' or 'tomorrow'."
                 date_str = target_date.isoformat() + 'T00:00:00Z'
                 if not date_str:
                     return ("I couldn't find a date in your request. "
                             "Please specify it like '2025-07-04'.")
                 
                 
-                start = datetime.combine(target_date, time(0, 0, 0))
-                end = datetime.combine(target_date, time(23, 59, 0))
-
-                timezone = pytz.timezone('Asia/Kolkata')
-                
-                start = timezone.localize(start)
-                end = timezone.localize(end)
-
+                start_iso, end_iso = _day_bounds_ist(target_date)
 
-                
-                busy = self.calendar_service.get_availability(
-                    start.isoformat(), end.isoformat()
+                # Calendar lookup and query embedding are independent, overlap them
+                busy_task = asyncio.create_task(
+                    self._get_availability(start_iso, end_iso)
                 )
+                normalized_query = query.strip().lower()
+                use_cache = not self.suggest_llm.temperature
+                embedding = await self._embed_query(normalized_query) if use_cache else None
+                busy = await busy_task
 
-                busy_str = ", ".join(
-                f"{datetime.fromisoformat(s['start'].replace('Z', '+00:00')).strftime('%H:%M')}-"
-                f"{datetime.fromisoformat(s['end'  ].replace('Z', '+00:00')).strftime('%H:%M')}"
-                for s in busy
-                )
+                busy_str = ", ".join(f"{s['start_hhmm']}-{s['end_hhmm']}" for s in busy)
 
                 
 
-                #Build precise prompt for Gemini
+                # Variable tail only, ordered from least to most changing
                 prompt = (
-                    "You're an expert scheduling assistant.\n"
-                    f"Task request: '{query}'.\n"
-                    f"Date: {date_str}.\n"
-                    f"Busy intervals on that date (24‑hour HH:MM): {busy_str}.\n"
-                    "Make sure the suggested time does NOT overlap with the busy intervals."
+                    f"Date: {date_str}\n"
+                    f"Busy: {busy_str}\n"
+                    f"Task: {query}"
                 )
 
+                # Only a deterministic model makes cached answers reusable
+                if use_cache:
+                    key = hashlib.sha256(orjson.dumps(
+                        {"date": date_str, "busy": busy_str, "query": normalized_query},
+                        option=orjson.OPT_SORT_KEYS
+                    )).hexdigest()
+                    bucket = f"{date_str}|{busy_str}"
+                    cached = self._get_cached_suggestion(key, bucket, embedding)
+                    if cached is not None:
+                        log.debug("✅ Suggestion served from cache")
+                        return cached
+
                 #call Gemini
                 
-                llm_resp = self.llm.invoke([HumanMessage(content=prompt)])
-                
-                return llm_resp.content.strip()
+                llm_resp = await self.suggest_llm.ainvoke([_SUGGEST_SYSTEM, HumanMessage(content=prompt)])
+                suggestion = llm_resp.content.strip()
+
+                if use_cache:
+                    self._store_suggestion(key, bucket, embedding, suggestion)
+                return suggestion
 
             except Exception as e:
-                print(f"error in suggesting_suitable_time: {e}")
+                log.error("❌ Error in suggest_suitable_time: %s", e)
 
 
-        def book_appointment(appointment_details: str) -> str:
+        async def book_appointment(start_time: datetime, end_time: datetime,
+                                   title: str = "Appointment", description: str = "") -> str:
             try:
                 now = datetime.now()
-                try:
-                    details = json.loads(appointment_details)
-                except json.JSONDecodeError:
-                    return "Please provide appointment details in proper JSON format."
-
-                start = datetime.fromisoformat(details['start_time'])
-                end = datetime.fromisoformat(details['end_time'])
-                
+                start = _to_local(start_time)
+                end = _to_local(end_time)
+                details = {
+                    "title": title,
+                    "start_time": start.isoformat(),
+                    "end_time": end.isoformat(),
+                    "description": description
+                }
 
                 # Past-time check
-                print(f"Booking appointment from {start} to {now}")
+                log.debug("Booking appointment from %s (now %s)", start, now)
                 if start < now:
                     return "Cannot book an appointment in the past. Please choose a future date/time."
 
                 # Clash detection
-                timezone = pytz.timezone('Asia/Kolkata')
-                
-                start = timezone.localize(start)
-                end = timezone.localize(end)
+                start = start.replace(tzinfo=_IST)
+                end = end.replace(tzinfo=_IST)
 
-                busy = self.calendar_service.get_availability(
-                    start.isoformat(), end.isoformat()
-                )
+                busy = await self._get_availability(start.isoformat(), end.isoformat())
                 # Store pending booking request
                 pending = {"details": details, "force": bool(busy)}
-                self.pending_bookings.append(pending)
+                session.pending_bookings.append(pending)
 
                 if busy:
                     # Ask user if they want to force-book despite clash
@@ -180,28 +544,107 @@ class AppointmentBookingAgent:
                         f"from {start.strftime('%I:%M %p')} to {end.strftime('%I:%M %p')}. OK? (yes/no)"
                     )
             except Exception as e:
-                print(f"❌ Error in book_appointment: {e}")
+                log.error("❌ Error in book_appointment: %s", e)
                 return f"Sorry, I couldn't book the appointment. Error: {str(e)}"    
             
-        def confirm_booking(answer: str) -> str:
-            if not self.pending_bookings:
+        async def book_appointments_batch(appointments: List[BookAppointmentArgs]) -> str:
+            try:
+                now = datetime.now()
+                if not appointments:
+                    return "Please provide at least one appointment to book."
+
+                slots = []
+                rejected = []
+                for item in appointments:
+                    item = BookAppointmentArgs.model_validate(item)
+                    start = _to_local(item.start_time)
+                    end = _to_local(item.end_time)
+                    details = {
+                        "title": item.title,
+                        "start_time": start.isoformat(),
+                        "end_time": end.isoformat(),
+                        "description": item.description
+                    }
+                    if start < now:
+                        rejected.append(f"'{details.get('title', 'Appointment')}' is in the past")
+                        continue
+                    slots.append((details, start.replace(tzinfo=_IST), end.replace(tzinfo=_IST)))
+
+                # Clash-check every slot with one FreeBusy call over their union
+                busy_lists = await asyncio.to_thread(
+                    self.calendar_service.get_availability_range,
+                    [(start.isoformat(), end.isoformat()) for _, start, end in slots]
+                )
+
+                lines = []
+                batch_id = next(self._batch_ids)
+                for (details, start, end), busy in zip(slots, busy_lists):
+                    session.pending_bookings.append({"details": details, "force": bool(busy), "batch": batch_id})
+                    clash = " (clashes with existing events)" if busy else ""
+                    lines.append(
+                        f"'{details.get('title', 'Appointment')}' on {start.strftime('%Y-%m-%d')} "
+                        f"from {start.strftime('%I:%M %p')} to {end.strftime('%I:%M %p')}{clash}"
+                    )
+
+                response = ""
+                if lines:
+                    response = "Booking " + "; ".join(lines) + ". Book all of them? (yes to all/no)"
+                if rejected:
+                    response += (" " if response else "") + "Skipped: " + "; ".join(rejected) + "."
+                return response
+            except Exception as e:
+                log.error("❌ Error in book_appointments_batch: %s", e)
+                return f"Sorry, I couldn't book the appointments. Error: {str(e)}"
+
+        async def confirm_booking(answer: str) -> str:
+            if not session.pending_bookings:
                 return "There is no booking to confirm."
             
             if not answer:
                 return "Please provide 'yes' to confirm or 'no' to cancel the booking."
 
             ans = answer.strip().lower()
-            pending = self.pending_bookings.pop()
-            details = pending['details']
+            if ans in ['yes to all', 'yes all', 'all']:
+                # Flush every queued booking in a single batch request
+                events = [p['details'] for p in session.pending_bookings]
+                try:
+                    results = await asyncio.to_thread(self.calendar_service.create_events_batch, events)
+                except Exception as e:
+                    # Keep the queue so the user can retry
+                    log.error("❌ Error in create_events_batch: %s", e)
+                    return f"❌ Failed to book the appointments: {str(e)}. Say 'yes to all' to try again."
+                session.pending_bookings.clear()
+                if any(r.get('success') for r in results):
+                    self._invalidate_calendar_caches()
+                lines = []
+                for details, result in zip(events, results):
+                    title = details.get('title', 'Appointment')
+                    if result.get('success'):
+                        lines.append(f"✅ Appointment '{title}' booked successfully!")
+                    else:
+                        lines.append(f"❌ Failed to book appointment '{title}': {result.get('message')}")
+                return "\n".join(lines)
 
             if ans not in ['yes', 'y']:
-                return "Booking cancelled. Let me know if you'd like another time."
+                batch_id = session.pending_bookings[-1].get('batch')
+                if batch_id is None:
+                    session.pending_bookings.pop()
+                    return "Booking cancelled. Let me know if you'd like another time."
+                # "no" to a batch prompt rejects every booking that batch queued
+                session.pending_bookings[:] = [
+                    p for p in session.pending_bookings if p.get('batch') != batch_id
+                ]
+                return "Bookings cancelled. Let me know if you'd like other times."
+
+            pending = session.pending_bookings.pop()
+            details = pending['details']
 
             # Proceed to create the event
             title = details.get('title', 'Appointment')
             start_iso = details['start_time']
             end_iso = details['end_time']
-            result = self.calendar_service.create_event(
+            result = await asyncio.to_thread(
+                self.calendar_service.create_event,
                 title=title,
                 start_time=start_iso,
                 end_time=end_iso,
@@ -209,103 +652,214 @@ class AppointmentBookingAgent:
             )
 
             if result.get('success'):
+                # The new event invalidates any cached busy intervals and replies
+                self._invalidate_calendar_caches()
                 return f"✅ Appointment '{title}' booked successfully!"
             else:
                 return f"❌ Failed to book appointment: {result.get('message')}"
 
         
-        def get_current_date(query) -> str:
-            """Get current date and time"""
-            return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        current_date = [None, ""]  # (epoch second, formatted value)
+
+        def get_current_date(query: str = "") -> str:
+            """Get current date and time, reusing the value within the same second"""
+            second = int(time_module.time())
+            if current_date[0] != second:
+                current_date[0] = second
+                current_date[1] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return current_date[1]
         
         return [
-            Tool(
+            StructuredTool.from_function(
                 name="check_availability",
-                description="Check available time slots for a specific date. Input: date in YYYY-MM-DD format, 'today', or 'tomorrow'.",
-                func=check_availability
+                description="Check available time slots for a specific date.",
+                func=_sync_fallback(check_availability),
+                coroutine=check_availability,
+                args_schema=CheckAvailabilityArgs
             ),
-            Tool(
+            StructuredTool.from_function(
                 name="book_appointment",
-                description=("Book an appointment in the calendar. Use this tool whenever the user wants to schedule, reserve, or set up a meeting, call, event, reminder or any other thing. and it will not confirm the booking "
-                "Input must be a JSON object with the following keys:\n"
-                "- 'title': a short title or purpose for the appointment (string)\n"
-                "- 'start_time': the ISO format start datetime (e.g., '2025-07-04T14:00:00')\n"
-                "- 'end_time': the ISO format end datetime (e.g., '2025-07-04T15:00:00')\n"
-                "- 'description': optional details about the appointment (string)\n\n"
+                description=("Book an appointment in the calendar. Use this tool whenever the user wants to schedule, reserve, or set up a meeting, call, event, reminder or any other thing. "
+                "It will not confirm the booking; the user confirms it with confirm_booking."),
+                func=_sync_fallback(book_appointment),
+                coroutine=book_appointment,
+                args_schema=BookAppointmentArgs
+            ),
+            StructuredTool.from_function(
+                name="book_appointments_batch",
+                description=("Book several appointments at once. Use this when the user wants to schedule more than one appointment in the same request; "
+                "it will not confirm the bookings."),
+                func=_sync_fallback(book_appointments_batch),
+                coroutine=book_appointments_batch,
+                args_schema=BookAppointmentsBatchArgs
+            ),
+            StructuredTool.from_function(
+                name="confirm_booking",
+                description="Confirm or cancel a pending booking from the pending list, or confirm every pending booking at once.",
+                func=_sync_fallback(confirm_booking),
+                coroutine=confirm_booking,
+                args_schema=ConfirmBookingArgs
             ),
-                func=book_appointment
+            StructuredTool.from_function(
+                name="suggest_suitable_time",
+                description="Suggest best time for a task based on calendar and LLM and also suggest best time for any planing or any work to do if it is realted to time.",
+                func=_sync_fallback(suggest_suitable_time),
+                coroutine=suggest_suitable_time,
+                args_schema=SuggestTimeArgs
             ),
-            Tool(name="confirm_booking", func=confirm_booking,
-                 description="Confirm or cancel a pending booking from the pending list. input: 'yes' to confirm or 'no' to cancel."),
-            Tool(name="suggest_suitable_time", func=suggest_suitable_time,
-                 description="Suggest best time for a task based on calendar and LLM and also suggest best time for any planing or any work to do if it is realted to time. Input1: date in YYYY-MM-DD format, 'today', or 'tomorrow'. Input2: detailed query"),
-            Tool(
+            StructuredTool.from_function(
                 name="get_current_date",
-                description="Get the current date and time. Input must be a non-empty string",
-                func=get_current_date
+                description="Get the current date and time.",
+                func=get_current_date,
+                args_schema=CurrentDateArgs
             )
         ]
     
-    def _create_agent(self):
-        """Create the conversational agent"""
-        system_message = """You are a helpful AI assistant that helps users book appointments on their Google Calendar.
-
-Your capabilities:
-1. Check calendar availability for specific dates
-2. Suggest available time slots
-3. Book appointments with user confirmation
-4. Handle natural language requests conversationally
-
-Guidelines:
-- Always be polite and conversational
-- Confirm details before booking
-- Ask for clarification when needed
-- Provide clear available time slots
-- Handle date parsing naturally (today, tomorrow, specific dates)
-- For booking, always confirm: title, date, time, and duration
-- Use the tools available to you: check_availability, book_appointment, get_current_date
-
-When booking appointments:
-- Always confirm all details with the user first
-- Ask for a title/purpose for the appointment
-- Clarify the duration if not specified (default to 1 hour)
-- Show available time slots before booking
-- if only time or only date is given before trying any tool ask the other thing
-"""
+    def _create_agent(self, tools: List[StructuredTool], memory):
+        """Create the tool-calling agent"""
+        from langchain.agents import AgentExecutor, create_tool_calling_agent
 
         try:
-            return initialize_agent(
-                tools=self.tools,
-                llm=self.llm,
-                agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
-                memory=self.memory,
-                verbose=True,
+            # Gemini's native function calling validates arguments against the
+            # tool schemas, so malformed calls no longer cost a retry round-trip
+            tool_agent = create_tool_calling_agent(self.llm, tools, AGENT_PROMPT).with_config(tags=[AGENT_LLM_TAG])
+            return AgentExecutor(
+                agent=tool_agent,
+                tools=tools,
+                memory=memory,
+                # Step-by-step chain output is only printed when debugging
+                verbose=log.isEnabledFor(logging.DEBUG),
                 max_iterations=3,
-                system_message=system_message,
-                early_stopping_method="generate",
                 handle_parsing_errors="I'm sorry, I didn’t understand that. Could you rephrase or give more details?"
             )
         except Exception as e:
-            print(f"❌ Error creating agent: {e}")
+            log.error("❌ Error creating agent: %s", e)
             raise
     
-    def chat(self, message: str) -> str:
+    async def _direct_response(self, session: ChatSession, message: str) -> Optional[str]:
+        """Answer messages that need no Gemini round-trip, None otherwise"""
+        text = message.strip().lower().rstrip('!.?')
+        response = None
+        if session.pending_bookings and _CONFIRM_RE.match(text):
+            answer = {'confirm': 'yes', 'cancel': 'no'}.get(text, text)
+            response = await session.tools['confirm_booking'].ainvoke({"answer": answer})
+        elif _GREETING_RE.match(text):
+            response = GREETING_RESPONSE
+        elif text == 'help':
+            response = HELP_RESPONSE
+        else:
+            response = await self._route_intent(session, message)
+        if response is not None:
+            # Keep the conversation history consistent with the agent path
+            session.memory.save_context({"input": message}, {"output": response})
+            log.info("✅ Direct response: %s", response)
+        return response
+
+    async def _route_intent(self, session: ChatSession, message: str) -> Optional[str]:
+        """Dispatch clearly classifiable requests straight to a tool, None otherwise"""
+        # "book ... 2025-07-04 ... {json}" -> book_appointment
+        if _BOOK_RE.search(message) and _ISO_DATE_RE.search(message):
+            block = _JSON_BLOCK_RE.search(message)
+            if block:
+                try:
+                    details = BookAppointmentArgs.model_validate(orjson.loads(block.group(0)))
+                except ValueError:
+                    details = None
+                if details is not None:
+                    return await session.tools['book_appointment'].ainvoke(details.model_dump())
+
+        # "what's the date/time" -> get_current_date
+        if _CURRENT_DATE_RE.search(message):
+            now = session.tools['get_current_date'].invoke({"query": ""})
+            return f"The current date and time is {now}."
+
+        # "available/free ... today|tomorrow|2025-07-04" or
+        # "check/show/list ... today|tomorrow|2025-07-04" -> check_availability
+        if (_AVAILABILITY_RE.search(message) or _CHECK_RE.search(message)) and not _PLANNING_RE.search(message):
+            date_token = _DATE_TOKEN_RE.search(message)
+            if date_token:
+                return await session.tools['check_availability'].ainvoke({"date_input": date_token.group(1)})
+
+        return None
+
+    async def warm_up(self) -> None:
+        """Open the Gemini chat and embedding connections with one tiny request each"""
+        # A single output token is enough to open the connection; an uncapped
+        # reply would hold up startup for a full generation
+        calls = [self.llm.bind(generation_config={"max_output_tokens": 1}).ainvoke("ping")]
+        if self.embeddings is not None:
+            calls.append(self.embeddings.aembed_query("ping"))
+        await asyncio.gather(*calls)
+
+    async def chat(self, message: str, session_id: str = "default") -> str:
         """Process user message and return response"""
         try:
-            print(f"💬 Processing message: {message}")
-            
-            # Simple responses for basic queries
-            # if "hello" in message.lower() or "hi" in message.lower():
-            #     return "Hello! I'm your AI appointment booking assistant. I can help you check availability and book appointments on your Google Calendar. What would you like to do?"
-            
-            # if "help" in message.lower():
-            #     return "I can help you with:\n• Check availability for specific dates\n• Book appointments\n• Suggest time slots\n\nTry saying 'Check availability for today' or 'Book a meeting tomorrow at 2 PM'"
-            
-            # Use the agent for complex queries
-            response = self.agent.run(message)
-            print(f"✅ Agent response: {response}")
+            log.info("💬 Processing message: %s", message)
+            session = self._get_session(session_id)
+            async with session.lock:
+                response = await self._direct_response(session, message)
+                if response is not None:
+                    return response
+
+                cached, cache_key = await self._cached_reply(session, message)
+                if cached is not None:
+                    return cached
+
+                # Use the agent for complex queries
+                result = await session.agent.ainvoke({"input": message})
+                response = result["output"]
+                self._store_reply(session, cache_key, response)
+            log.info("✅ Agent response: %s", response)
             return response
             
         except Exception as e:
-            print(f"❌ Error in chat: {e}")
-            return f"I apologize, but I encountered an error: {str(e)}. Please try a simpler request like 'Check availability for today'."
\ No newline at end of file
+            log.error("❌ Error in chat: %s", e)
+            return f"I apologize, but I encountered an error: {str(e)}. Please try a simpler request like 'Check availability for today'."
+
+    async def chat_stream(self, message: str, session_id: str = "default") -> AsyncIterator[str]:
+        """Process user message and yield the final answer as Gemini generates it"""
+        try:
+            log.info("💬 Streaming message: %s", message)
+            session = self._get_session(session_id)
+            async with session.lock:
+                async for chunk in self._stream_turn(session, message):
+                    yield chunk
+
+        except Exception as e:
+            log.error("❌ Error in chat_stream: %s", e)
+            yield f"I apologize, but I encountered an error: {str(e)}. Please try a simpler request like 'Check availability for today'."
+
+    async def _stream_turn(self, session: ChatSession, message: str) -> AsyncIterator[str]:
+        """Yield one turn's answer for chat_stream; the caller holds the session lock"""
+        response = await self._direct_response(session, message)
+        if response is not None:
+            yield response
+            return
+
+        cached, cache_key = await self._cached_reply(session, message)
+        if cached is not None:
+            yield cached
+            return
+
+        # Only the agent's own model calls are streamed; LLM calls made inside
+        # tools (e.g. suggest_suitable_time) are summarized by the agent anyway
+        chunks = []
+        root_run_id = None
+        final_output = None
+        async for event in session.agent.astream_events({"input": message}, version="v2"):
+            kind = event["event"]
+            if root_run_id is None:
+                root_run_id = event["run_id"]
+            if kind == "on_chat_model_stream" and AGENT_LLM_TAG in event.get("tags", []):
+                chunk = event["data"]["chunk"].content
+                if isinstance(chunk, str) and chunk:
+                    chunks.append(chunk)
+                    yield chunk
+            elif kind == "on_chain_end" and event["run_id"] == root_run_id:
+                final_output = event["data"].get("output", {}).get("output")
+
+        # Parsing-error and iteration-limit answers are not model output
+        if not chunks and final_output:
+            yield final_output
+        self._store_reply(session, cache_key, final_output or "".join(chunks))
+        log.info("✅ Agent response streamed: %s", final_output)
@@ -1,16 +1,21 @@
 import os
+import asyncio
+import logging
+import orjson
+from functools import lru_cache
+from typing import AsyncIterator, List
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from calendar_service import CalendarService
-from agent import AppointmentBookingAgent
-from datetime import datetime, timedelta
-from fastapi.responses import FileResponse, Response
+from datetime import datetime
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+log = logging.getLogger(__name__)
 
-app = FastAPI(title="Appointment Booking AI API", version="1.0.0")
+app = FastAPI(title="Appointment Booking AI API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -20,32 +25,77 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    ip = request.client.host
-    method = request.method
-    path = request.url.path
-    print(f"👀 {ip} - {method} {path}")
-    response = await call_next(request)
-    return response
-
-# Initialize services
-calendar_service = CalendarService(
-    credentials_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
-    calendar_id=os.getenv("CALENDAR_ID")
-)
+# Requests are logged by uvicorn's access log rather than a middleware
 
-agent = AppointmentBookingAgent(
-    calendar_service=calendar_service,
-    gemini_api_key=os.getenv("GEMINI_API_KEY")
-)
+# Initialize services on first use; the agent's LangChain and Google imports
+# would otherwise add seconds to every cold start
+@lru_cache(maxsize=None)
+def get_calendar_service():
+    from calendar_service import CalendarService
+
+    return CalendarService(
+        credentials_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+        calendar_id=os.getenv("CALENDAR_ID")
+    )
+
+@lru_cache(maxsize=None)
+def get_agent():
+    from agent import AppointmentBookingAgent
+
+    return AppointmentBookingAgent(
+        calendar_service=get_calendar_service(),
+        gemini_api_key=os.getenv("GEMINI_API_KEY")
+    )
+
+# Session used by the startup warm-up, dropped once it has run
+WARMUP_SESSION = "__warmup__"
+
+@app.on_event("startup")
+async def warmup():
+    """Do the agent's and Calendar's one-time setup before the first request.
+
+    Set SKIP_WARMUP to start instantly in local development.
+    """
+    if os.getenv("SKIP_WARMUP"):
+        return
+    try:
+        agent = await asyncio.to_thread(get_agent)
+        # Imports the langchain agent and memory modules and builds a session's
+        # tools and agent; the greeting itself is answered without Gemini
+        await agent.chat("hello", WARMUP_SESSION)
+        agent.drop_session(WARMUP_SESSION)
+
+        await asyncio.gather(
+            # One tiny Gemini request per client opens their connections
+            agent.warm_up(),
+            # The OAuth token is shared; per-thread Calendar connections still
+            # open on their first request
+            asyncio.to_thread(get_calendar_service().warm_up),
+        )
+        log.info("✅ Warm-up complete")
+    except Exception as e:
+        log.warning("⚠️ Warm-up failed, services will initialize on first request: %s", e)
+
+@app.on_event("shutdown")
+async def save_caches():
+    """Keep cached chat replies across restarts when SEMANTIC_CACHE_PATH is set"""
+    if get_agent.cache_info().currsize:
+        get_agent().save_response_cache()
 
 class ChatMessage(BaseModel):
     message: str
+    session_id: str = "default"
 
 class ChatResponse(BaseModel):
     response: str
 
+class ChatBatch(BaseModel):
+    messages: List[str]
+    session_id: str = "default"
+
+class ChatBatchResponse(BaseModel):
+    responses: List[str]
+
 @app.get("/")
 async def root():
     return {"message": "Appointment Booking AI API is running!"}
@@ -54,10 +104,36 @@ async def root():
 async def chat(message: ChatMessage):
     """Handle chat messages"""
     try:
-        response = agent.chat(message.message)
+        response = await get_agent().chat(message.message, message.session_id)
         return ChatResponse(response=response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat_batch", response_model=ChatBatchResponse)
+async def chat_batch(batch: ChatBatch):
+    """Handle several queued messages from one session in a single round-trip"""
+    try:
+        agent = get_agent()
+        # In order: each turn can depend on the previous one's memory and bookings
+        responses = [await agent.chat(m, batch.session_id) for m in batch.messages]
+        return ChatBatchResponse(responses=responses)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _sse(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """Encode text chunks as Server-Sent Events carrying {"token": ...}"""
+    async for chunk in chunks:
+        yield b"data: " + orjson.dumps({"token": chunk}) + b"\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Stream the reply to a chat message as Server-Sent Events, one token per event"""
+    return StreamingResponse(
+        _sse(get_agent().chat_stream(message.message, message.session_id)),
+        media_type="text/event-stream",
+        # Stop reverse proxies from buffering the stream into one response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
     
 @app.get("/favicon.ico")
 async def favicon():
@@ -70,8 +146,13 @@ async def root_head(request: Request):
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {"status": "ok", "timestamp": datetime.now()}
 
 if __name__ == "__main__":
+    import copy
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=10000)
\ No newline at end of file
+    from uvicorn.config import LOGGING_CONFIG
+
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config["formatters"]["access"]["fmt"] = '%(asctime)s %(levelprefix)s %(client_addr)s - "%(request_line)s" %(status_code)s'
+    uvicorn.run(app, host="0.0.0.0", port=10000, log_config=log_config)
\ No newline at end of file
@@ -1,24 +1,98 @@
 import os
+import logging
+import threading
+import time
+from functools import cached_property, lru_cache
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from typing import List, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
 from googleapiclient.errors import HttpError
-import pytz
+import google_auth_httplib2
+import httplib2
+import numpy as np
+from fast_slots import free_intervals
+
+log = logging.getLogger(__name__)
+
+# Google Calendar accepts at most 50 calls in one batch request
+BATCH_LIMIT = 50
+
+# Resolved once; every naive time in this service is Indian Standard Time
+_TZ = ZoneInfo('Asia/Kolkata')
+
+# Busy intervals are reused for this long unless a booking touches the window
+AVAILABILITY_CACHE_TTL = 60  # seconds
+
+# Socket timeout (seconds) for the pooled Calendar HTTP connections
+HTTP_TIMEOUT = 30
+# Retries with backoff for transient errors on read-only requests; inserts
+# are not retried since a lost response would create a duplicate event
+HTTP_READ_RETRIES = 3
+
+
+@lru_cache(maxsize=4096)
+def _iso_to_hhmm(iso: str) -> str:
+    """Format an ISO timestamp as HH:MM, memoized since busy events repeat across requests"""
+    return datetime.fromisoformat(iso.replace('Z', '+00:00')).strftime('%H:%M')
+
+@lru_cache(maxsize=4096)
+def _day_bounds(date_iso: str) -> Tuple[datetime, datetime]:
+    """Localized 00:00 and 23:59 IST for a YYYY-MM-DD date"""
+    day = datetime.strptime(date_iso, '%Y-%m-%d')
+    return day.replace(tzinfo=_TZ), day.replace(hour=23, minute=59, tzinfo=_TZ)
 
 class CalendarService:
     def __init__(self, credentials_path: str, calendar_id: str):
         self.credentials_path = credentials_path
         self.calendar_id = calendar_id
-        self.service = self._authenticate()
-        
-    def _authenticate(self):
-        """Authenticate with Google Calendar API using service account"""
-        credentials = service_account.Credentials.from_service_account_file(
+        # httplib2 connections are not thread-safe and the agent calls in from
+        # worker threads, so each thread keeps its own keep-alive connection
+        self._local = threading.local()
+        # (start, end) -> (fetched_at, busy, window_start, window_end)
+        self._avail_cache: Dict[Tuple[str, str], tuple] = {}
+        self._avail_lock = threading.Lock()
+
+    # The Google client libraries are slow to import, so credentials and the
+    # API client are only loaded on the first Calendar call
+    @cached_property
+    def credentials(self):
+        """Service account credentials, loaded on first use"""
+        from google.oauth2 import service_account
+
+        return service_account.Credentials.from_service_account_file(
             self.credentials_path,
             scopes=['https://www.googleapis.com/auth/calendar']
         )
-        return build('calendar', 'v3', credentials=credentials)
+
+    @cached_property
+    def service(self):
+        """Calendar API client, built on first use and reused afterwards"""
+        return self._authenticate()
+        
+    def _authenticate(self):
+        """Authenticate with Google Calendar API using service account"""
+        from googleapiclient.discovery import build
+
+        return build('calendar', 'v3', credentials=self.credentials)
+
+    def warm_up(self) -> None:
+        """Fetch the OAuth token and build the API client before the first request.
+
+        The token lives on the shared credentials, so every thread's connection
+        uses it; the connections themselves are per thread and open on first use.
+        """
+        self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+        self.service
+
+    def _http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """Authorized HTTP client for the calling thread, reused across requests"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT)
+            )
+            self._local.http = http
+        return http
     
     def _parse_datetime(self, dt_string: str) -> datetime:
         """Parse datetime string and ensure timezone awareness"""
@@ -30,71 +104,137 @@ class CalendarService:
 
                 dt = datetime.strptime(dt_string, '%Y-%m-%d %H:%M:%S')
                 if dt.tzinfo is None:
-                    dt = pytz.timezone('Asia/Kolkata').localize(dt)
+                    dt = dt.replace(tzinfo=_TZ)
             
             return dt
         except Exception as e:
-            print(f"Error parsing datetime {dt_string}: {e}")
+            log.error("Error parsing datetime %s: %s", dt_string, e)
             raise
     
+    def freebusy_query(self, time_min: str, time_max: str, calendar_ids: List[str]) -> Dict[str, List[Dict]]:
+        """Fetch busy intervals for several calendars in one FreeBusy request.
+
+        Returns a mapping of calendar id to its busy list. Google computes the
+        intervals server-side, so no events are listed or paged here.
+        """
+        body = {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "items": [{"id": cid} for cid in calendar_ids]
+        }
+        response = self.service.freebusy().query(body=body).execute(
+            http=self._http(), num_retries=HTTP_READ_RETRIES
+        )
+        calendars = response.get('calendars', {})
+        return {cid: calendars.get(cid, {}).get('busy', []) for cid in calendar_ids}
+
     def get_availability(self, start_date: str, end_date: str) -> List[Dict]:
-        """Get busy times for the specified date range"""
+        """Get busy times for the specified date range.
+
+        Each entry keeps the raw ISO 'start'/'end' and adds pre-formatted
+        'start_hhmm'/'end_hhmm' strings.
+        """
+        key = (start_date, end_date)
+        with self._avail_lock:
+            entry = self._avail_cache.get(key)
+        if entry and time.monotonic() - entry[0] < AVAILABILITY_CACHE_TTL:
+            # Copies, so a caller editing its list can't change the cached one
+            return [dict(b) for b in entry[1]]
+
         try:
             # Convert to datetime objects
-            print(f"Checking availability from {start_date} to {end_date}")
+            log.debug("Checking availability from %s to %s", start_date, end_date)
             start_dt = self._parse_datetime(start_date)
             end_dt = self._parse_datetime(end_date)
             
             # Get busy times
-            body = {
-                "timeMin": start_dt.isoformat(),
-                "timeMax": end_dt.isoformat(),
-                "items": [{"id": self.calendar_id}]
-            }
-            
-            response = self.service.freebusy().query(body=body).execute()
-            busy_times = response['calendars'][self.calendar_id]['busy']
+            busy_times = self.freebusy_query(
+                start_dt.isoformat(), end_dt.isoformat(), [self.calendar_id]
+            )[self.calendar_id]
+            for b in busy_times:
+                b['start_hhmm'] = _iso_to_hhmm(b['start'])
+                b['end_hhmm'] = _iso_to_hhmm(b['end'])
             
-            return busy_times
+            now = time.monotonic()
+            with self._avail_lock:
+                # Every distinct window gets an entry, so expired ones go on write
+                for stale in [k for k, e in self._avail_cache.items() if now - e[0] >= AVAILABILITY_CACHE_TTL]:
+                    del self._avail_cache[stale]
+                self._avail_cache[key] = (now, busy_times, start_dt, end_dt)
+            return [dict(b) for b in busy_times]
             
         except HttpError as error:
-            print(f"Error checking availability: {error}")
+            log.error("Error checking availability: %s", error)
             return []
     
     
     
+    def get_availability_range(self, windows: List[Tuple[str, str]]) -> List[List[Dict]]:
+        """Get busy times for several windows with one FreeBusy call over their union.
+
+        Returns one busy list per window, in input order, holding the intervals
+        that overlap it.
+        """
+        if not windows:
+            return []
+        bounds = [(self._parse_datetime(s), self._parse_datetime(e)) for s, e in windows]
+        union_start = min(s for s, _ in bounds)
+        union_end = max(e for _, e in bounds)
+        busy_times = self.get_availability(union_start.isoformat(), union_end.isoformat())
+        parsed = [
+            (datetime.fromisoformat(b['start'].replace('Z', '+00:00')),
+             datetime.fromisoformat(b['end'].replace('Z', '+00:00')),
+             b)
+            for b in busy_times
+        ]
+        return [[b for bs, be, b in parsed if bs < we and be > ws] for ws, we in bounds]
+
+    def _invalidate_availability(self, start_time: str, end_time: str) -> None:
+        """Drop cached busy times for every window overlapping a new event"""
+        start_dt = self._parse_datetime(start_time)
+        end_dt = self._parse_datetime(end_time)
+        with self._avail_lock:
+            for key, entry in list(self._avail_cache.items()):
+                if entry[2] < end_dt and entry[3] > start_dt:
+                    del self._avail_cache[key]
+    
+    def _build_event(self, title: str, start_time: str, end_time: str, description: str = "") -> Dict:
+        """Build an event body for the Calendar API"""
+        # Parse and format datetime strings properly
+        start_dt = self._parse_datetime(start_time)
+        end_dt = self._parse_datetime(end_time)
+        
+        # Ensure we have timezone-aware datetimes
+        if start_dt.tzinfo is None:
+            start_dt = start_dt.replace(tzinfo=_TZ)
+        if end_dt.tzinfo is None:
+            end_dt = end_dt.replace(tzinfo=_TZ)
+        
+        return {
+            'summary': title,
+            'description': description,
+            'start': {
+                'dateTime': start_dt.isoformat(),
+                'timeZone': 'Asia/Kolkata',
+            },
+            'end': {
+                'dateTime': end_dt.isoformat(),
+                'timeZone': 'Asia/Kolkata',
+            },
+        }
+
     def create_event(self, title: str, start_time: str, end_time: str, description: str = "") -> Dict:
         """Create a new calendar event"""
         try:
-            # Parse and format datetime strings properly
-            start_dt = self._parse_datetime(start_time)
-            end_dt = self._parse_datetime(end_time)
-            
-            # Ensure we have timezone-aware datetimes
-            if start_dt.tzinfo is None:
-                start_dt = pytz.timezone('Asia/Kolkata').localize(start_dt)
-            if end_dt.tzinfo is None:
-                end_dt = pytz.timezone('Asia/Kolkata').localize(end_dt)
+            event = self._build_event(title, start_time, end_time, description)
             
-            event = {
-                'summary': title,
-                'description': description,
-                'start': {
-                    'dateTime': start_dt.isoformat(),
-                    'timeZone': 'Asia/Kolkata',
-                },
-                'end': {
-                    'dateTime': end_dt.isoformat(),
-                    'timeZone': 'Asia/Kolkata',
-                },
-            }
-            
-            print(f"Creating event: {event}")  # Debug logging
+            log.debug("Creating event: %s", event)
             
             created_event = self.service.events().insert(
                 calendarId=self.calendar_id,
                 body=event
-            ).execute()
+            ).execute(http=self._http())
+            self._invalidate_availability(event['start']['dateTime'], event['end']['dateTime'])
             
             return {
                 'success': True,
@@ -104,51 +244,102 @@ class CalendarService:
             }
             
         except HttpError as error:
-            print(f"Error creating event: {error}")
+            log.error("Error creating event: %s", error)
             return {
                 'success': False,
                 'message': f'Error creating event: {str(error)}'
             }
         except Exception as error:
-            print(f"Unexpected error creating event: {error}")
+            log.error("Unexpected error creating event: %s", error)
             return {
                 'success': False,
                 'message': f'Unexpected error: {str(error)}'
             }
+
+    def create_events_batch(self, events: List[Dict]) -> List[Dict]:
+        """Create several events using batch requests of up to BATCH_LIMIT inserts.
+
+        Each item takes the create_event arguments (title, start_time, end_time,
+        description). Results are returned in input order with the same shape
+        as create_event.
+        """
+        results: List[Optional[Dict]] = [None] * len(events)
+        bodies: List[Optional[Dict]] = [None] * len(events)
+
+        def on_response(request_id, response, exception):
+            index = int(request_id)
+            if exception is not None:
+                log.error("Error creating event: %s", exception)
+                results[index] = {
+                    'success': False,
+                    'message': f'Error creating event: {str(exception)}'
+                }
+            else:
+                body = bodies[index]
+                self._invalidate_availability(body['start']['dateTime'], body['end']['dateTime'])
+                results[index] = {
+                    'success': True,
+                    'event_id': response['id'],
+                    'event_link': response.get('htmlLink', ''),
+                    'message': 'Event created successfully!'
+                }
+
+        for offset in range(0, len(events), BATCH_LIMIT):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for index in range(offset, min(offset + BATCH_LIMIT, len(events))):
+                item = events[index]
+                try:
+                    body = self._build_event(
+                        item.get('title', 'Appointment'),
+                        item['start_time'],
+                        item['end_time'],
+                        item.get('description', '')
+                    )
+                except Exception as error:
+                    results[index] = {
+                        'success': False,
+                        'message': f'Unexpected error: {str(error)}'
+                    }
+                    continue
+                bodies[index] = body
+                batch.add(
+                    self.service.events().insert(calendarId=self.calendar_id, body=body),
+                    request_id=str(index)
+                )
+            try:
+                log.debug("Creating %d events in one batch", len(events[offset:offset + BATCH_LIMIT]))
+                batch.execute(http=self._http())
+            except HttpError as error:
+                log.error("Error executing event batch: %s", error)
+                for index in range(offset, min(offset + BATCH_LIMIT, len(events))):
+                    if results[index] is None:
+                        results[index] = {
+                            'success': False,
+                            'message': f'Error creating event: {str(error)}'
+                        }
+
+        return results
         
     def get_free_intervals_for_date(self, target_date: str, skip_before: str) -> List:
 
         # use full-day range 00:00 to 23:59
         try:
             # Parse the date
-            timezone = pytz.timezone('Asia/Kolkata')
+            timezone = _TZ
         
             if 'T' in target_date:
                 target_date = datetime.fromisoformat(target_date.replace('Z', '+00:00')).date()
             else:
                 target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
             if skip_before:
+                now_time = datetime.now().time()
                 if 'T' in skip_before:
                     skip_before = datetime.fromisoformat(skip_before.replace('Z', '+00:00')).date()
-                    skip_before = datetime.combine(skip_before, datetime.now().time())
-                    skip_before = timezone.localize(skip_before)
                 else:
                     skip_before = datetime.strptime(skip_before, '%Y-%m-%d').date()
-                    skip_before = datetime.combine(skip_before, datetime.now().time())
-                    skip_before = timezone.localize(skip_before)
-                
-            print("skip",skip_before)
+                skip_before = datetime.combine(skip_before, now_time, timezone)
 
-            
-            start_time = datetime.combine(target_date, datetime.min.time())
-            end_time = datetime.combine(target_date, datetime.min.time().replace(hour=23, minute=59))
-            print("check0")
-            
-            # Add timezone
-            timezone = pytz.timezone('Asia/Kolkata')
-            print(timezone)
-            start_time = timezone.localize(start_time)
-            end_time = timezone.localize(end_time)
+            start_time, end_time = _day_bounds(target_date.isoformat())
             
             
             # Get busy times
@@ -156,31 +347,34 @@ class CalendarService:
                 start_time.isoformat(),
                 end_time.isoformat()
             )
-            print("check1")
     
-            busy_sorted = sorted(busy_times, key=lambda x: x['start'])
-            print("check2")
-            free = []
+            # Parse each busy interval once into epoch seconds, sorted by start
+            busy_s = np.array(
+                [int(datetime.fromisoformat(b['start'].replace('Z', '+00:00')).timestamp()) for b in busy_times],
+                dtype=np.int64
+            )
+            busy_e = np.array(
+                [int(datetime.fromisoformat(b['end'].replace('Z', '+00:00')).timestamp()) for b in busy_times],
+                dtype=np.int64
+            )
+            order = np.argsort(busy_s, kind='stable')
             cursor = start_time
-            print(cursor, skip_before)
-
-            print(f"strat: {start_time}, end: {end_time}, skip_before: {skip_before}")
-            for b in busy_sorted:
-                bs = datetime.fromisoformat(b['start'].replace('Z','+00:00')).astimezone(timezone)
-                be = datetime.fromisoformat(b['end'].replace('Z','+00:00')).astimezone(timezone)
-                if skip_before and cursor < skip_before:
-                    cursor = skip_before
-                    skip_before = None
-                if cursor < bs:
-                    free.append({'start': cursor, 'end': bs})
-                cursor = max(cursor, be)
             if skip_before and cursor < skip_before:
                 cursor = skip_before
-            if cursor < end_time:
-                free.append({'start': cursor, 'end': end_time})
+            log.debug("Free slots for %s to %s, cursor %s", start_time, end_time, cursor)
+            free_s, free_e = free_intervals(
+                busy_s[order], busy_e[order],
+                np.int64(cursor.timestamp()), np.int64(end_time.timestamp()),
+                np.int64(0)
+            )
+            # Only the final gaps are turned back into local datetimes
+            free = [
+                {'start': datetime.fromtimestamp(int(fs), timezone), 'end': datetime.fromtimestamp(int(fe), timezone)}
+                for fs, fe in zip(free_s, free_e)
+            ]
             return [True,free]
         except Exception as error:
-            print(f"Error suggesting time slots: {error}")
+            log.error("Error finding free intervals: %s", error)
             return [False,error]
     
 
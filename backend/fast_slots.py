@@ -0,0 +1,46 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the sweep then runs as plain Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(cache=True)
+def free_intervals(busy_s, busy_e, day_s, day_e, max_slots=0):
+    """Free gaps in [day_s, day_e] around busy intervals, all in epoch seconds.
+
+    busy_s/busy_e must be int64 arrays sorted by start. Returns the gap
+    starts and ends as two int64 arrays, stopping after max_slots gaps when
+    it is positive.
+    """
+    n = busy_s.shape[0]
+    out_s = np.empty(n + 1, np.int64)
+    out_e = np.empty(n + 1, np.int64)
+    k = 0
+    cursor = day_s
+    for i in range(n):
+        # Later intervals start even later, so nothing else fits in the day
+        if cursor >= day_e:
+            break
+        if cursor < busy_s[i]:
+            out_s[k] = cursor
+            out_e[k] = busy_s[i]
+            k += 1
+            if k == max_slots:
+                return out_s[:k], out_e[:k]
+        if cursor < busy_e[i]:
+            cursor = busy_e[i]
+    if cursor < day_e:
+        out_s[k] = cursor
+        out_e[k] = day_e
+        k += 1
+    return out_s[:k], out_e[:k]
+
+
+# Compile (or load the cached build) now so the first request doesn't pay for it.
+# max_slots is passed explicitly as callers do, so this builds the signature they use
+free_intervals(np.zeros(1, np.int64), np.ones(1, np.int64), np.int64(0), np.int64(2), np.int64(0))
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+import orjson
+
+
+def _bucket_id(bucket: str) -> int:
+    """Stable 64-bit id for a bucket name, the same across restarts"""
+    return int.from_bytes(hashlib.sha256(bucket.encode()).digest()[:8], "little", signed=True)
+
+
+class SemanticCache:
+    """Cache of chat responses looked up by cosine similarity of prompt embeddings.
+
+    Embeddings are kept L2-normalized in one preallocated float32 matrix so a
+    lookup is a single matrix-vector product. A prompt only matches entries
+    stored under the same bucket. Entries expire after ttl seconds; their rows
+    are reused by later adds, and the least recently used entry is replaced
+    once max_entries is reached.
+    """
+
+    # Rows allocated for the first entry; capacity doubles from there
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, threshold: float = 0.90, max_entries: int = 10000, ttl: float = 300):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clear()
+
+    def clear(self) -> None:
+        """Drop every cached response"""
+        self.mat: Optional[np.ndarray] = None
+        self.size = 0  # rows of mat in use, live or expired
+        self.created = np.empty(0)
+        self.last_used = np.empty(0)
+        self.buckets = np.empty(0, np.int64)
+        self.responses: List[Optional[str]] = []
+
+    def __len__(self) -> int:
+        return int(self._fresh(time.time()).sum())
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _fresh(self, now: float) -> np.ndarray:
+        return now - self.created[:self.size] <= self.ttl
+
+    def _allocate(self, dim: int, capacity: int) -> None:
+        self.clear()
+        self.mat = np.empty((capacity, dim), np.float32)
+        self.created = np.full(capacity, -np.inf)
+        self.last_used = np.zeros(capacity)
+        self.buckets = np.zeros(capacity, np.int64)
+
+    def _grow(self) -> None:
+        capacity = min(2 * len(self.mat), self.max_entries)
+        extra = capacity - len(self.mat)
+        self.mat = np.concatenate([self.mat, np.empty((extra, self.mat.shape[1]), np.float32)])
+        self.created = np.concatenate([self.created, np.full(extra, -np.inf)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(extra)])
+        self.buckets = np.concatenate([self.buckets, np.zeros(extra, np.int64)])
+
+    def lookup(self, embedding, bucket: str = "") -> Optional[str]:
+        """Return the response of the most similar fresh prompt in bucket, None on a miss"""
+        if not self.size:
+            return None
+        vec = self._normalize(embedding)
+        if vec.shape[0] != self.mat.shape[1]:
+            return None
+        now = time.time()
+        sims = self.mat[:self.size] @ vec
+        # Expired rows and other buckets must not win over a fresh runner-up
+        sims[~self._fresh(now) | (self.buckets[:self.size] != _bucket_id(bucket))] = -np.inf
+        index = int(sims.argmax())
+        if sims[index] < self.threshold:
+            return None
+        self.last_used[index] = now
+        return self.responses[index]
+
+    def add(self, embedding, response: str, bucket: str = "") -> None:
+        """Store a response, reusing an expired row or replacing the least recently used one"""
+        vec = self._normalize(embedding)
+        if self.mat is None or vec.shape[0] != self.mat.shape[1]:
+            self._allocate(vec.shape[0], min(self.INITIAL_CAPACITY, self.max_entries))
+        now = time.time()
+        fresh = self._fresh(now)
+        # Free expired rows so their responses don't linger in memory
+        for i in np.flatnonzero(~fresh):
+            self.responses[i] = None
+        if not fresh.all():
+            index = int(np.argmin(fresh))
+        elif self.size < self.max_entries:
+            if self.size == len(self.mat):
+                self._grow()
+            index = self.size
+            self.size += 1
+            self.responses.append(None)
+        else:
+            index = int(np.argmin(self.last_used[:self.size]))
+        self.mat[index] = vec
+        self.created[index] = now
+        self.last_used[index] = now
+        self.buckets[index] = _bucket_id(bucket)
+        self.responses[index] = response
+
+    def save(self, path: str) -> None:
+        """Write the fresh entries to <path>.npy and <path>.json"""
+        if self.mat is None:
+            return
+        keep = np.flatnonzero(self._fresh(time.time()))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.save(f"{path}.npy", self.mat[keep])
+        with open(f"{path}.json", "wb") as f:
+            f.write(orjson.dumps({
+                "responses": [self.responses[i] for i in keep],
+                "created": self.created[keep].tolist(),
+                "last_used": self.last_used[keep].tolist(),
+                "buckets": self.buckets[keep].tolist(),
+            }))
+
+    def load(self, path: str) -> None:
+        """Restore a cache written by save, keeping only unexpired entries"""
+        if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+            return
+        mat = np.load(f"{path}.npy")
+        with open(f"{path}.json", "rb") as f:
+            meta = orjson.loads(f.read())
+        # Files from before bucketing can't be matched to a conversation
+        if "buckets" not in meta:
+            return
+        now = time.time()
+        keep = [i for i, created in enumerate(meta["created"]) if now - created <= self.ttl]
+        keep = keep[-self.max_entries:]
+        if not keep:
+            return
+        self._allocate(mat.shape[1], max(len(keep), min(self.INITIAL_CAPACITY, self.max_entries)))
+        n = len(keep)
+        self.mat[:n] = mat[keep]
+        self.created[:n] = [meta["created"][i] for i in keep]
+        self.last_used[:n] = [meta["last_used"][i] for i in keep]
+        self.buckets[:n] = [meta["buckets"][i] for i in keep]
+        self.responses = [meta["responses"][i] for i in keep]
+        self.size = n
@@ -1,20 +1,46 @@
 import streamlit as st
+import asyncio
+import base64
+import contextlib
+import itertools
+import logging
+import threading
+import time
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:  # orjson is optional; fall back to the stdlib parser
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
 from datetime import datetime
 import os
+import re
+import uuid
+import zlib
+from typing import Iterator
 from dotenv import load_dotenv
-
-load_dotenv()
-BACKEND_URL = os.getenv("BACKEND_URL")
-
-# ---------- Page config ----------
-st.set_page_config(page_title="AI Appointment Booking",
-                   page_icon="📅", layout="wide")
-
-# ---------- CSS ----------
-st.markdown("""
-<style>
+from streamlit.errors import StreamlitAPIException
+
+@st.cache_resource
+def _config() -> dict:
+    """Read .env and the environment once per process, not on every rerun."""
+    load_dotenv()
+    return {"backend_url": os.getenv("BACKEND_URL")}
+
+BACKEND_URL = _config()["backend_url"]
+log = logging.getLogger(__name__)
+
+# ---------- Static HTML ----------
+# Kept as constants so each rerun just references them. They are still written
+# every run: Streamlit drops any element a rerun doesn't emit, so a
+# once-per-session guard would blank the styling after the first interaction.
+_CSS_RAW = """
 .main-header {
     text-align: center;
     padding: 2rem 0;
@@ -33,25 +59,6 @@ st.markdown("""
     background-color: #f8f9fa;
 }
 
-.user-message {
-    background-color: #007bff;
-    color: white;
-    padding: 10px 15px;
-    border-radius: 18px;
-    margin: 5px 0;
-    margin-left: 20%;
-    text-align: right;
-}
-
-.bot-message {
-    background-color: #e9ecef;
-    color: #333;
-    padding: 10px 15px;
-    border-radius: 18px;
-    margin: 5px 0;
-    margin-right: 20%;
-}
-
 .stButton > button {
     width: 100%;
     background-color: #007bff;
@@ -65,40 +72,260 @@ st.markdown("""
 .stButton > button:hover {
     background-color: #0056b3;
 }
-</style>
+"""
+
+def _minify_css(css: str) -> str:
+    """Strip comments and the whitespace around CSS punctuation."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return re.sub(r"\s+", " ", css).strip()
+
+# Minified once at import; this is the copy every rerun sends to the browser
+CSS_BLOB = f"<style>{_minify_css(_CSS_RAW)}</style>"
+
+HEADER_HTML = """
+<div class="main-header">
+  <h1>🤖 AI Appointment Booking Assistant</h1>
+  <p>Chat with me to book appointments on your Google Calendar!</p>
+</div>
+"""
+
+CALENDAR_URL = "https://calendar.google.com/calendar/u/0?cid=YzI5MzFiM2U1M2Y4YTFiMDI1ZWI5MjM5MmM0N2UzZjI1MTI5ZWZhNjdkN2FjNmNhZjU0OGMwYmIyYzdkYTk0NUBncm91cC5jYWxlbmRhci5nb29nbGUuY29t"
+
+# 📆 Open Calendar button (full width)
+CALENDAR_BUTTON_HTML = f"""<br>
+<a href="{CALENDAR_URL}" target="_blank">
+    <button style='width: 100%;
+                   padding: 12px 0;
+                   font-size: 16px;
+                   border: none;
+                   border-radius: 5px;
+                   background-color: #007bff;
+                   color: white;
+                   font-weight: bold;
+                   cursor: pointer;'>
+        📆 Open Calendar
+    </button>
+</a>
+"""
+
+# Footer icons, inlined so the page doesn't fetch them from a third-party host
+_ICON_SVGS = {
+    "phone": '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24"><path d="M6.62 10.79c1.44 2.83 3.76 5.14 6.59 6.59l2.2-2.2c.27-.27.67-.36 1.02-.24 1.12.37 2.33.57 3.57.57.55 0 1 .45 1 1V20c0 .55-.45 1-1 1-9.39 0-17-7.61-17-17 0-.55.45-1 1-1h3.5c.55 0 1 .45 1 1 0 1.25.2 2.45.57 3.57.11.35.03.74-.25 1.02l-2.2 2.2z"/></svg>',
+    "email": '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24"><path d="M20 4H4c-1.1 0-1.99.9-1.99 2L2 18c0 1.1.9 2 2 2h16c1.1 0 2-.9 2-2V6c0-1.1-.9-2-2-2zm0 4l-8 5-8-5V6l8 5 8-5v2z"/></svg>',
+    "linkedin": '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24"><rect width="24" height="24" rx="3"/><g fill="#fff"><rect x="5" y="9.5" width="3" height="9"/><circle cx="6.5" cy="6.25" r="1.75"/><path d="M10.5 9.5h2.9v1.3c.5-.9 1.6-1.5 2.9-1.5 2.3 0 3.2 1.4 3.2 3.8v5.4h-3v-4.8c0-1.1-.3-1.9-1.4-1.9-1.1 0-1.6.8-1.6 1.9v4.8h-3z"/></g></svg>',
+    "github": '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 16 16"><path d="M8 0C3.58 0 0 3.58 0 8c0 3.54 2.29 6.53 5.47 7.59.4.07.55-.17.55-.38 0-.19-.01-.82-.01-1.49-2.01.37-2.53-.49-2.69-.94-.09-.23-.48-.94-.82-1.13-.28-.15-.68-.52-.01-.53.63-.01 1.08.58 1.23.82.72 1.21 1.87.87 2.33.66.07-.52.28-.87.51-1.07-1.78-.2-3.64-.89-3.64-3.95 0-.87.31-1.59.82-2.15-.08-.2-.36-1.02.08-2.12 0 0 .67-.21 2.2.82.64-.18 1.32-.27 2-.27.68 0 1.36.09 2 .27 1.53-1.04 2.2-.82 2.2-.82.44 1.1.16 1.92.08 2.12.51.56.82 1.27.82 2.15 0 3.07-1.87 3.75-3.65 3.95.29.25.54.73.54 1.48 0 1.07-.01 1.93-.01 2.2 0 .21.15.46.55.38A8.013 8.013 0 0016 8c0-4.42-3.58-8-8-8z"/></svg>',
+}
+ICONS = {name: "data:image/svg+xml;base64," + base64.b64encode(svg.encode()).decode()
+         for name, svg in _ICON_SVGS.items()}
+
+FOOTER_HTML = f"""
+<hr>
+<div style="text-align: center; color: #666; padding: 1rem; font-size: 15px;">
+
+  <p style="font-size: 16px;">
+    <strong>Built by</strong> 
+    <img src="https://avatars.githubusercontent.com/u/87754699?v=4" 
+         style="height: 1.5em; vertical-align: middle; border-radius: 50%; margin: 0 5px;">
+    <strong>Nitish Biswas</strong>
+  </p>
+
+  <p>
+    <img src="{ICONS['phone']}" style="vertical-align: middle;"/> +91-8979053318 &nbsp;|&nbsp;
+    <img src="{ICONS['email']}" style="vertical-align: middle;"/> <a href="mailto:nitishbiswas066@gmail.com">nitishbiswas066@gmail.com</a> &nbsp;|&nbsp;
+    <img src="{ICONS['linkedin']}" style="vertical-align: middle;"/> <a href="https://www.linkedin.com/in/nitish-biswas1/" target="_blank">LinkedIn</a> &nbsp;|&nbsp;
+    <img src="{ICONS['github']}" style="vertical-align: middle;"/> <a href="https://github.com/Nitish-Biswas" target="_blank">GitHub</a> &nbsp;|&nbsp;
+  </p>
 
-""", unsafe_allow_html=True)
+</div>
+"""
+
+# ---------- Page config ----------
+st.set_page_config(page_title="AI Appointment Booking",
+                   page_icon="📅", layout="wide")
+
+# ---------- CSS ----------
+st.html(CSS_BLOB)
 
 # ---------- Session state ----------
 st.session_state.setdefault("messages", [])
+# Identifies this browser session to the backend's per-session agent state
+st.session_state.setdefault("session_id", uuid.uuid4().hex)
+# Quick-action messages waiting to be sent together
+st.session_state.setdefault("pending", [])
+st.session_state.setdefault("pending_since", 0.0)
+# Older messages, zlib-compressed in chunks of at least ARCHIVE_CHUNK, oldest first
+st.session_state.setdefault("archive", [])
+st.session_state.setdefault("show_archive", False)
 
 # ---------- Helper -----------
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One keep-alive connection pool per process, shared by every rerun."""
+    session = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def async_backend() -> tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]:
+    """Event loop on a daemon thread owning one pooled AsyncClient per process."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    # Chat posts are only retried when the connection fails: a request that
+    # reached the agent may already have booked something
+    transport = httpx.AsyncHTTPTransport(
+        retries=2, limits=httpx.Limits(max_keepalive_connections=8))
+    client = httpx.AsyncClient(timeout=httpx.Timeout(25, connect=3), transport=transport)
+    return loop, client
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and wait for its result."""
+    loop, _ = async_backend()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+def _parse(resp: httpx.Response) -> dict:
+    """Decode a JSON response body straight from its bytes."""
+    return json_loads(resp.content)
+
+def draw_message(m: dict) -> None:
+    """One chat bubble in the current container."""
+    with st.chat_message("user" if m["role"] == "user" else "assistant"):
+        st.markdown(m["content"])
+
+def _stream_chat(user_text: str, session_id: str) -> Iterator[str]:
+    """Yield reply tokens as the backend's /chat/stream sends them."""
+    with http_session().post(f"{BACKEND_URL}/chat/stream",
+                             json={"message": user_text, "session_id": session_id},
+                             stream=True, timeout=(3, 60)) as resp:
+        if resp.status_code != 200:
+            yield f"Error: {resp.status_code} - {resp.text}"
+            return
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("data: "):
+                yield json_loads(line[6:])["token"]
+
 def send_message(user_text: str) -> None:
-    """Append user message, hit backend, append bot reply."""
-    st.session_state.messages.append({"role": "user", "content": user_text})
+    """Append and draw the user message, then stream the bot reply into view."""
+    user_message = {"role": "user", "content": user_text}
+    st.session_state.messages.append(user_message)
+    draw_message(user_message)
+
+    with st.chat_message("assistant"):
+        try:
+            with st.spinner("🤔 AI is thinking..."):
+                tokens = _stream_chat(user_text, st.session_state.session_id)
+                first = next(tokens, "")
+            bot_text = st.write_stream(itertools.chain([first], tokens))
+        except requests.exceptions.RequestException as e:
+            bot_text = f"Connection error: {e}"
+            st.markdown(bot_text)
+        except Exception as e:
+            bot_text = f"Unexpected error: {e}"
+            st.markdown(bot_text)
+
+    st.session_state.messages.append({"role": "bot", "content": bot_text})
+
+# At most this many messages stay live in session state; older ones are
+# compressed into the archive at least ARCHIVE_CHUNK at a time
+MAX_HISTORY = 200
+ARCHIVE_CHUNK = 50
+
+def trim_history() -> None:
+    """Compress the oldest messages into the archive beyond MAX_HISTORY."""
+    messages = st.session_state.messages
+    if len(messages) <= MAX_HISTORY:
+        return
+    # Move at least a whole chunk so each blob is worth compressing
+    moved = max(len(messages) - MAX_HISTORY, ARCHIVE_CHUNK)
+    st.session_state.archive.append(zlib.compress(json_dumps(messages[:moved])))
+    del messages[:moved]
+    # The renderers index into messages; keep them on the same entries
+    st.session_state.rendered = max(0, st.session_state.get("rendered", 0) - moved)
+
+# How long a queued quick action waits for more clicks before it is sent
+BATCH_WINDOW = 0.15
+
+async def _post_chat_batch(texts: list[str], session_id: str) -> httpx.Response:
+    _, client = async_backend()
+    return await client.post(f"{BACKEND_URL}/chat_batch",
+                             json={"messages": texts, "session_id": session_id})
+
+def enqueue(user_text: str) -> None:
+    """Queue a message to go out with any others sent in the next BATCH_WINDOW."""
+    if not st.session_state.pending:
+        st.session_state.pending_since = time.monotonic()
+    st.session_state.pending.append(user_text)
+
+def flush_pending() -> None:
+    """Send every queued message and draw the turns in the current container.
+
+    A single message streams from /chat/stream; several share one /chat_batch call.
+    """
+    pending, st.session_state.pending = st.session_state.pending, []
+    if len(pending) <= 1:
+        for user_text in pending:
+            send_message(user_text)
+        trim_history()
+        return
 
     try:
-        resp = requests.post(f"{BACKEND_URL}/chat",
-                             json={"message": user_text},
-                             timeout=30)
+        with st.spinner("🤔 AI is thinking..."):
+            resp = run_async(_post_chat_batch(pending, st.session_state.session_id))
         if resp.status_code == 200:
-            bot_text = resp.json().get("response", "")
+            bot_texts = _parse(resp).get("responses", [])
         else:
-            bot_text = f"Error: {resp.status_code} - {resp.text}"
-    except requests.exceptions.RequestException as e:
-        bot_text = f"Connection error: {e}"
+            bot_texts = [f"Error: {resp.status_code} - {resp.text}"] * len(pending)
+    except httpx.HTTPError as e:
+        bot_texts = [f"Connection error: {e}"] * len(pending)
     except Exception as e:
-        bot_text = f"Unexpected error: {e}"
+        bot_texts = [f"Unexpected error: {e}"] * len(pending)
 
-    st.session_state.messages.append({"role": "bot", "content": bot_text})
+    for user_text, bot_text in zip(pending, bot_texts):
+        for m in ({"role": "user", "content": user_text}, {"role": "bot", "content": bot_text}):
+            st.session_state.messages.append(m)
+            draw_message(m)
+    trim_history()
+
+# Seconds between background /health probes
+HEALTH_INTERVAL = 10
+
+def backend_health(backend_url: str) -> tuple[bool, str]:
+    """Probe the backend's /health endpoint."""
+    try:
+        response = http_session().get(f"{backend_url}/health", timeout=(3, 5))
+        if response.status_code == 200:
+            return True, "✅ Backend Connected"
+        log.warning("⚠️ Health check returned %s", response.status_code)
+        return False, "❌ Backend Error"
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        log.warning("⚠️ Backend unreachable: %s", e)
+        return False, "❌ Backend Offline"
+    except requests.exceptions.RequestException as e:
+        log.warning("⚠️ Health check failed: %s", e)
+        return False, "❌ Backend Error"
+
+@st.cache_resource
+def health_monitor(backend_url: str) -> dict:
+    """Keep {"health": (ok, status)} fresh from a daemon thread, so reruns never wait on the probe."""
+    state = {"health": (None, "⏳ Checking Backend...")}
+
+    def probe_forever() -> None:
+        while True:
+            try:
+                state["health"] = backend_health(backend_url)
+            except Exception:
+                # Keep probing; a dead thread would freeze the last status forever
+                log.exception("❌ Health probe crashed")
+            time.sleep(HEALTH_INTERVAL)
+
+    threading.Thread(target=probe_forever, daemon=True).start()
+    return state
 
 # ---------- Header ----------
-st.markdown("""
-<div class="main-header">
-  <h1>🤖 AI Appointment Booking Assistant</h1>
-  <p>Chat with me to book appointments on your Google Calendar!</p>
-</div>
-""", unsafe_allow_html=True)
+st.html(HEADER_HTML)
 
 # ---------- Sidebar ----------
 with st.sidebar:
@@ -118,24 +345,38 @@ with st.sidebar:
     """)
 
     st.markdown("### 🔧 System Status")
-    try:
-        response = requests.get(f"{BACKEND_URL}/health", timeout=5)
-        if response.status_code == 200:
-            st.success("✅ Backend Connected")
-        else:
-            st.error("❌ Backend Error")
-    except:
-        st.error("❌ Backend Offline")
+    healthy, status = health_monitor(BACKEND_URL)["health"]
+    if healthy is None:
+        st.info(status)
+    elif healthy:
+        st.success(status)
+    else:
+        st.error(status)
 
 # ---------- Chat history ----------
+trim_history()
+
+if st.session_state.archive:
+    if st.session_state.show_archive:
+        for blob in st.session_state.archive:
+            for m in json_loads(zlib.decompress(blob)):
+                draw_message(m)
+    elif st.button("📜 Load older messages"):
+        st.session_state.show_archive = True
+        st.rerun()
+
 chat_container = st.container()
-for m in st.session_state.messages:
-    if m["role"] == "user":
-        chat_container.markdown(f'<div class="user-message">{m["content"]}</div>',
-                                unsafe_allow_html=True)
-    else:
-        chat_container.markdown(f'<div class="bot-message">{m["content"]}</div>',
-                                unsafe_allow_html=True)
+# How many messages have been drawn into chat_container during this run
+st.session_state.rendered = 0
+
+def render_new_messages() -> None:
+    """Append the messages not yet drawn this run to the chat history."""
+    with chat_container:
+        for m in st.session_state.messages[st.session_state.rendered:]:
+            draw_message(m)
+    st.session_state.rendered = len(st.session_state.messages)
+
+render_new_messages()
 
 # ---------- Input area ----------
 with st.form("chat_form", clear_on_submit=True):
@@ -147,70 +388,58 @@ with st.form("chat_form", clear_on_submit=True):
     submitted = st.form_submit_button("Send 📤")
 
 if submitted and user_input:
-    with st.spinner("🤔 AI is thinking..."):
-        send_message(user_input)
-    st.rerun()   # show the reply immediately
+    enqueue(user_input)
+    with chat_container:   # the reply streams in without rerunning the page
+        flush_pending()
+    st.session_state.rendered = len(st.session_state.messages)
 
 # ---------- Quick actions ----------
-col1, col2, col3 = st.columns(3)
-
-with col1:
-    if st.button("📅 Check Today's Availability"):
-        send_message("Check availability for today")
-        st.rerun()
-
-with col2:
-    if st.button("🔄 Check Tomorrow's Availability"):
-        send_message("Check availability for tomorrow")
-        st.rerun()
-
-with col3:
-    if st.button("🗑️ Clear Chat"):
-        st.session_state.messages.clear()
-        st.rerun()
-
-
-CALENDAR_URL = "https://calendar.google.com/calendar/u/0?cid=YzI5MzFiM2U1M2Y4YTFiMDI1ZWI5MjM5MmM0N2UzZjI1MTI5ZWZhNjdkN2FjNmNhZjU0OGMwYmIyYzdkYTk0NUBncm91cC5jYWxlbmRhci5nb29nbGUuY29t"
-
-# 📆 Open Calendar button (full width)
-st.markdown("<br>", unsafe_allow_html=True)
-
-st.markdown(f"""
-<a href="{CALENDAR_URL}" target="_blank">
-    <button style='width: 100%;
-                   padding: 12px 0;
-                   font-size: 16px;
-                   border: none;
-                   border-radius: 5px;
-                   background-color: #007bff;
-                   color: white;
-                   font-weight: bold;
-                   cursor: pointer;'>
-        📆 Open Calendar
-    </button>
-</a>
-""", unsafe_allow_html=True)
+@st.fragment
+def quick_actions() -> None:
+    """Quick-action row; its buttons rerun just this fragment, not the whole page."""
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        if st.button("📅 Check Today's Availability"):
+            enqueue("Check availability for today")
+
+    with col2:
+        if st.button("🔄 Check Tomorrow's Availability"):
+            enqueue("Check availability for tomorrow")
+
+    with col3:
+        if st.button("🗑️ Clear Chat"):
+            st.session_state.messages.clear()
+            st.session_state.pending.clear()
+            st.session_state.archive.clear()
+            st.session_state.show_archive = False
+            st.rerun()   # the history lives outside this fragment
+
+    if st.session_state.pending:
+        wait = BATCH_WINDOW - (time.monotonic() - st.session_state.pending_since)
+        if wait > 0:
+            # Clicks don't interrupt a running fragment; one made during the
+            # wait is folded into this rerun and joins the queue before it is sent
+            time.sleep(wait)
+            # Only allowed in a fragment rerun; a full app run just sends the queue
+            with contextlib.suppress(StreamlitAPIException):
+                st.rerun(scope="fragment")
+
+    # What a fragment writes outside itself is redrawn on each of its reruns,
+    # so this redraws every message added since the last full run first
+    with fragment_turns.container():
+        for m in st.session_state.messages[st.session_state.rendered:]:
+            draw_message(m)
+        flush_pending()
+
+# Slot at the end of the history for the turns quick actions add; Streamlit
+# only lets a fragment write to outside containers claimed in the full run
+fragment_turns = chat_container.empty()
+quick_actions()
+
+st.html(CALENDAR_BUTTON_HTML)
 
 # ---------- Footer ----------
-st.markdown("""
----
-<div style="text-align: center; color: #666; padding: 1rem; font-size: 15px;">
-
-  <p style="font-size: 16px;">
-    <strong>Built by</strong> 
-    <img src="https://avatars.githubusercontent.com/u/87754699?v=4" 
-         style="height: 1.5em; vertical-align: middle; border-radius: 50%; margin: 0 5px;">
-    <strong>Nitish Biswas</strong>
-  </p>
-
-  <p>
-    <img src="https://img.icons8.com/ios-filled/20/phone.png" style="vertical-align: middle;"/> +91-8979053318 &nbsp;|&nbsp;
-    <img src="https://img.icons8.com/ios-filled/20/email.png" style="vertical-align: middle;"/> <a href="mailto:nitishbiswas066@gmail.com">nitishbiswas066@gmail.com</a> &nbsp;|&nbsp;
-    <img src="https://img.icons8.com/ios-filled/20/linkedin.png" style="vertical-align: middle;"/> <a href="https://www.linkedin.com/in/nitish-biswas1/" target="_blank">LinkedIn</a> &nbsp;|&nbsp;
-    <img src="https://img.icons8.com/ios-filled/20/github.png" style="vertical-align: middle;"/> <a href="https://github.com/Nitish-Biswas" target="_blank">GitHub</a> &nbsp;|&nbsp;
-  </p>
-
-</div>
-""", unsafe_allow_html=True)
+st.html(FOOTER_HTML)
 
 